@@ -1,54 +1,75 @@
+import asyncio
+import logging
 import os
-import subprocess
+import re
 import time
 
-def run_batch():
-    video_dir = "test_videos"
-    files = sorted([f for f in os.listdir(video_dir) if f.startswith("test video") and f.endswith(".mp4")])
-    
-    # Sort by number correctly (1, 2, ..., 10, not 1, 10, 11...)
-    def get_num(name):
-        try:
-            return int(name.replace("test video ", "").replace(".mp4", ""))
-        except:
-            return 999
-            
-    files.sort(key=get_num)
-    
-    # Filter for 11-15
-    target_files = [f for f in files if 11 <= get_num(f) <= 15]
-    
-    print(f"Found {len(target_files)} videos to process: {target_files}")
-    
-    for filename in target_files:
-        path = os.path.join(video_dir, filename)
-        print(f"\n\n{'='*50}")
-        print(f"PROCESSING: {filename}")
-        print(f"{'='*50}\n")
-        
+from main import configure_logging, is_completed, process_video
+
+logger = logging.getLogger(__name__)
+
+# Max number of videos processed at the same time (bounded to respect API rate limits)
+MAX_CONCURRENT_VIDEOS = 4
+
+VIDEO_NAME_RE = re.compile(r"test video (\d+)\.mp4")
+
+async def _process_video(path: str, filename: str, semaphore: asyncio.Semaphore) -> bool:
+    """
+    Runs the pipeline on a single video in a worker thread of this process.
+    """
+    async with semaphore:
+        logger.info(">>> PROCESSING: %s", filename)
         start_time = time.time()
         try:
-            # Run main.py
-            # blocking call
-            result = subprocess.run(
-                ["python3", "main.py", path],
-                capture_output=False, # Let it stream to stdout
-                text=True
-            )
-            
-            if result.returncode != 0:
-                print(f"❌ ERROR processing {filename}. Exit code: {result.returncode}")
-            else:
-                print(f"✅ SUCCESS processing {filename}")
-                
+            success = await asyncio.to_thread(process_video, path)
         except Exception as e:
-            print(f"❌ EXCEPTION processing {filename}: {e}")
-            
+            logger.error("❌ EXCEPTION processing %s: %s", filename, e)
+            return False
+
         elapsed = time.time() - start_time
-        print(f"Time taken: {elapsed:.2f}s")
-        
-        # Small cooldown to be nice to API
-        time.sleep(2)
+        # One summary line per video
+        if success:
+            logger.info("✅ SUCCESS processing %s (%.2fs)", filename, elapsed)
+        else:
+            logger.error("❌ ERROR processing %s (%.2fs)", filename, elapsed)
+        return success
+
+async def _run_all(jobs: list) -> list:
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_VIDEOS)
+    return await asyncio.gather(*(_process_video(path, filename, semaphore) for path, filename in jobs))
+
+def run_batch():
+    configure_logging()
+
+    video_dir = "test_videos"
+    # One pass: keep "test video <N>.mp4" files with their number, then sort numerically
+    # (1, 2, ..., 10, not 1, 10, 11...). Other files are ignored instead of sorted to the end.
+    numbered = []
+    with os.scandir(video_dir) as it:
+        for entry in it:
+            match = VIDEO_NAME_RE.fullmatch(entry.name)
+            if match and entry.is_file():
+                numbered.append((int(match.group(1)), entry.name))
+    numbered.sort()
+
+    # Filter for 11-15
+    target_files = [f for num, f in numbered if 11 <= num <= 15]
+
+    # Skip videos finished by a previous (possibly interrupted) run
+    done = [f for f in target_files if is_completed(os.path.join(video_dir, f))]
+    if done:
+        logger.info("Skipping %d already processed videos: %s", len(done), done)
+        target_files = [f for f in target_files if f not in done]
+
+    logger.info("Found %d videos to process: %s", len(target_files), target_files)
+
+    jobs = [(os.path.join(video_dir, filename), filename) for filename in target_files]
+
+    start_time = time.time()
+    results = asyncio.run(_run_all(jobs))
+    elapsed = time.time() - start_time
+
+    logger.info("Batch complete: %d/%d succeeded in %.2fs", sum(results), len(results), elapsed)
 
 if __name__ == "__main__":
     run_batch()
@@ -1,33 +1,124 @@
 import argparse
+import atexit
+import hashlib
 import json
+import logging
 import os
+import queue
 import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from video_processor import extract_frames_to_folder
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+import orjson
+from video_processor import extract_frames_to_memory, save_frames
 from vlm_client import perform_visual_analysis, perform_olfactory_inference
 
-def main():
-    parser = argparse.ArgumentParser(description="Olfactory Video Analysis System (VOS Pipeline)")
-    parser.add_argument("video_path", help="Path to the input video file")
-    
-    # Allow user to pass fps as a positional argument (optional)
-    # e.g. python main.py video.mp4 10
-    parser.add_argument("fps_pos", nargs="?", type=int, help="Frames per second to extract (positional)")
+logger = logging.getLogger(__name__)
+
+# (condition name, Step 1 prompt, Step 2 prompt, report suffix)
+EXPERIMENTS = [
+    ("OURS (System-generated Plan)", "step1_visual.txt", "step2_olfactory.txt", "OURS"),
+    ("BASELINE 1 (Over-Inclusive)", "step1_visual_overinclusive.txt", "step2_olfactory_overinclusive.txt", "BASELINE_OVERINCLUSIVE"),
+    ("BASELINE 2 (Naive/Object-Based)", "step1_visual_naive.txt", "step2_olfactory_naive.txt", "BASELINE_NAIVE")
+]
+
+# Completion markers let reruns skip videos that were already fully processed
+DONE_DIR = os.path.join("output_reports", ".done")
+
+_log_listener = None
+
+def configure_logging(level: int = logging.INFO):
+    """
+    Routes log records through a queue to a single stdout writer thread,
+    so parallel videos/conditions never block on (or interleave within) stdout.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [QueueHandler(log_queue)]
+    # httpx logs every API request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _log_listener = QueueListener(log_queue, handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+def run_condition(name: str, visual_prompt: str, olfactory_prompt: str, out_path: str, frames: list, target_fps: int, video_path: str, use_cache: bool = True):
+    """
+    Runs one experimental condition (Step 1 -> Step 2) and saves its report.
+    With `use_cache=False` both steps call the API again instead of reusing cache/ results.
+    """
+    logger.info(">>> Running Condition: %s (Visual Prompt: %s, Olfactory Prompt: %s)", name, visual_prompt, olfactory_prompt)
     
-    parser.add_argument("--output", help="Path to save the JSON output", default=None)
-    parser.add_argument("--fps", type=int, default=4, help="Frames per second to extract (flag)")
+    # Independent Step 1
+    # Frames are uploaded on the first Step 1 cache miss; the other conditions reuse those File API handles
+    visual_report = perform_visual_analysis(frames, target_fps, prompt_file=visual_prompt, use_cache=use_cache, upload=True)
     
-    args = parser.parse_args()
+    # Independent Step 2
+    report = perform_olfactory_inference(visual_report, prompt_file=olfactory_prompt, use_cache=use_cache)
     
-    # Logic: If positional fps is provided, use it; otherwise use flag or default
-    target_fps = args.fps_pos if args.fps_pos is not None else args.fps
+    # Add local metadata
+    report.meta["source_video"] = video_path
+    report.meta["generated_at"] = datetime.now().isoformat()
+    report.meta["experiment_condition"] = name
     
-    if not os.path.exists(args.video_path):
-        print(f"Error: Video file not found at {args.video_path}")
-        return
+    # orjson serializes the nested report much faster than Pydantic's indented JSON encoder
+    Path(out_path).write_bytes(orjson.dumps(report.model_dump(mode="json"), option=orjson.OPT_INDENT_2))
+    logger.info("    Saved to: %s (%s)", out_path, name)
+
+def _pipeline_version() -> str:
+    """
+    Fingerprint of everything that shapes a report besides the video itself:
+    the prompt files of every condition and config.json.
+    """
+    h = hashlib.sha1()
+    paths = [p for _, visual_prompt, olfactory_prompt, _ in EXPERIMENTS for p in (visual_prompt, olfactory_prompt)]
+    for path in paths + ["config.json"]:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+def _completion_marker(video_path: str, fps: int, output: str = None) -> str:
+    # An explicit --output is part of the key: a run writing elsewhere is a different job
+    # (left out when not given, so markers of default-output runs keep their key)
+    output_key = f"|{os.path.abspath(output)}" if output else ""
+    key = hashlib.sha1(f"{os.path.abspath(video_path)}|{fps}{output_key}|{_pipeline_version()}".encode()).hexdigest()
+    return os.path.join(DONE_DIR, key)
+
+def is_completed(video_path: str, fps: int = 4, output: str = None) -> bool:
+    """
+    True if this video was already processed at this FPS (and output path) with the current prompts/config.
+    """
+    return os.path.exists(_completion_marker(video_path, fps, output))
+
+def process_video(video_path: str, fps: int = 4, output: str = None, persist_frames: bool = True, force: bool = False) -> bool:
+    """
+    Runs the full pipeline (frame extraction + 3 experimental conditions) on one video.
+    Skips videos that already completed with the same FPS, output path, prompts and config unless `force` is set;
+    `force` also bypasses the Step 1 / Step 2 response caches, so every condition is regenerated.
+    Returns True if every condition produced a report.
+    """
+    if not os.path.exists(video_path):
+        logger.error("Error: Video file not found at %s", video_path)
+        return False
+
+    marker = _completion_marker(video_path, fps, output)
+    if not force and os.path.exists(marker):
+        logger.info("Skipping %s: already processed at %s FPS (marker %s)", video_path, fps, marker)
+        return True
 
     # Prepare output paths
-    base = os.path.splitext(os.path.basename(args.video_path))[0]
+    base = os.path.splitext(os.path.basename(video_path))[0]
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     # Ensure output_reports directory exists
@@ -35,72 +126,89 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     
     # We will generate 3 files, so we modify the output path strategy
-    if args.output:
+    if output:
         # If user provided a specific file, we will use it as a prefix/base
-        # e.g. "result.json" -> "result_ours.json", "result_naive.json", etc.
-        user_base, user_ext = os.path.splitext(args.output)
-        path_ours = f"{user_base}_OURS{user_ext}"
-        path_over = f"{user_base}_BASELINE_OVERINCLUSIVE{user_ext}"
-        path_naive = f"{user_base}_BASELINE_NAIVE{user_ext}"
+        # e.g. "result.json" -> "result_OURS.json", "result_BASELINE_NAIVE.json", etc.
+        user_base, user_ext = os.path.splitext(output)
+        out_paths = {suffix: f"{user_base}_{suffix}{user_ext}" for *_, suffix in EXPERIMENTS}
     else:
         # Default behavior
-        path_ours = os.path.join(output_dir, f"{base}_OURS_{timestamp}.json")
-        path_over = os.path.join(output_dir, f"{base}_BASELINE_OVERINCLUSIVE_{timestamp}.json")
-        path_naive = os.path.join(output_dir, f"{base}_BASELINE_NAIVE_{timestamp}.json")
+        out_paths = {suffix: os.path.join(output_dir, f"{base}_{suffix}_{timestamp}.json") for *_, suffix in EXPERIMENTS}
         
     temp_folder = os.path.join("temp_frames", f"{base}_{timestamp}")
 
     try:
         # Step 1: Extract Frames (Ground Truth)
-        print("\n--- Step 1: Frame Extraction ---")
-        print(f"Target FPS: {target_fps}")
-        frame_paths = extract_frames_to_folder(args.video_path, temp_folder, target_fps)
+        logger.info("--- Step 1: Frame Extraction (Target FPS: %s) ---", fps)
+        # Frames stay in memory as JPEG bytes; disk is only touched for the ground-truth copy
+        frames = extract_frames_to_memory(video_path, fps)
         
-        if not frame_paths:
-            print("No frames extracted.")
-            return
+        if not frames:
+            logger.error("No frames extracted.")
+            return False
+
+        if persist_frames:
+            save_frames(frames, temp_folder)
 
         # Step 3: Run 3 Experimental Conditions
-        print("\n--- Step 2 & 3: Running Independent Pipelines ---")
+        logger.info("--- Step 2 & 3: Running Independent Pipelines ---")
         
-        experiments = [
-            ("OURS (System-generated Plan)", "step1_visual.txt", "step2_olfactory.txt", path_ours),
-            ("BASELINE 1 (Over-Inclusive)", "step1_visual_overinclusive.txt", "step2_olfactory_overinclusive.txt", path_over),
-            ("BASELINE 2 (Naive/Object-Based)", "step1_visual_naive.txt", "step2_olfactory_naive.txt", path_naive)
-        ]
-        
-        for name, visual_prompt, olfactory_prompt, out_path in experiments:
-            print(f"\n>>> Running Condition: {name}...")
-            print(f"    Visual Prompt: {visual_prompt}")
-            print(f"    Olfactory Prompt: {olfactory_prompt}")
-            
-            try:
-                # Independent Step 1
-                visual_report = perform_visual_analysis(frame_paths, target_fps, prompt_file=visual_prompt)
-                
-                # Independent Step 2
-                report = perform_olfactory_inference(visual_report, prompt_file=olfactory_prompt)
-                
-                # Add local metadata
-                report.meta["source_video"] = args.video_path
-                report.meta["generated_at"] = datetime.now().isoformat()
-                report.meta["experiment_condition"] = name
-                
-                with open(out_path, "w") as f:
-                    f.write(report.model_dump_json(indent=2))
-                print(f"    Saved to: {out_path}")
-                
-            except Exception as e:
-                print(f"    FAILED Condition {name}: {e}")
-
-        print(f"\nAll experiments complete!")
-        print(f"Ground truth frames are preserved in: {temp_folder}")
+        # The conditions share no state and are bound by API latency, so run them concurrently
+        with ThreadPoolExecutor(max_workers=len(EXPERIMENTS)) as executor:
+            futures = {
+                executor.submit(run_condition, name, visual_prompt, olfactory_prompt, out_paths[suffix], frames, fps, video_path, not force): name
+                for name, visual_prompt, olfactory_prompt, suffix in EXPERIMENTS
+            }
+            failed = []
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(name)
+                    logger.error("    FAILED Condition %s: %s", name, e)
+
+        logger.info("All experiments complete for %s!", video_path)
+        if persist_frames:
+            logger.info("Ground truth frames are preserved in: %s", temp_folder)
+
+        if failed:
+            return False
+
+        # Only mark the video done once every condition produced its report
+        os.makedirs(DONE_DIR, exist_ok=True)
+        with open(marker, "w") as f:
+            json.dump({"video_path": video_path, "fps": fps, "reports": list(out_paths.values())}, f)
+        return True
 
     except Exception as e:
-        print(f"\nCRITICAL ERROR: {e}")
+        logger.critical("CRITICAL ERROR: %s", e)
+        return False
         
     # Note: We do NOT delete temp_folder automatically, 
     # because the user guideline says "These original frames are the benchmark for verification".
 
+def main():
+    parser = argparse.ArgumentParser(description="Olfactory Video Analysis System (VOS Pipeline)")
+    parser.add_argument("video_path", help="Path to the input video file")
+    
+    # Allow user to pass fps as a positional argument (optional)
+    # e.g. python main.py video.mp4 10
+    parser.add_argument("fps_pos", nargs="?", type=int, help="Frames per second to extract (positional)")
+    
+    parser.add_argument("--output", help="Path to save the JSON output", default=None)
+    parser.add_argument("--fps", type=int, default=4, help="Frames per second to extract (flag)")
+    parser.add_argument("--save-frames", action=argparse.BooleanOptionalAction, default=True,
+                        help="Persist extracted frames to temp_frames/ as ground truth (--no-save-frames keeps them in memory only)")
+    parser.add_argument("--force", action="store_true", help="Re-run even if this video was already processed with the same FPS, prompts and config, ignoring cached Step 1/Step 2 responses")
+    
+    args = parser.parse_args()
+    configure_logging()
+    
+    # Logic: If positional fps is provided, use it; otherwise use flag or default
+    target_fps = args.fps_pos if args.fps_pos is not None else args.fps
+    
+    process_video(args.video_path, target_fps, output=args.output, persist_frames=args.save_frames, force=args.force)
+
 if __name__ == "__main__":
     main()
@@ -126,3 +126,9 @@ class VisualAnalysisReport(BaseModel):
     meta: dict
     visual_timeline: List[VisualInterval]
     frame_log: List[VisualFrameAnalysis]
+
+# OlfactoryEvent references EvidenceRef before it is defined. Resolve the forward
+# reference now so the validators are fully built at import, not lazily on the
+# first (possibly concurrent) model_validate_json call.
+OlfactoryEvent.model_rebuild()
+OlfactoryAnalysisReport.model_rebuild()
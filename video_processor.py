@@ -1,17 +1,189 @@
 import cv2
+import logging
 import os
 import shutil
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
-def extract_frames_to_folder(video_path: str, output_folder: str, target_fps: int = 4) -> List[str]:
+import numpy as np
+
+# PyAV is optional. When available, frames are decoded on the GPU (NVDEC),
+# otherwise we fall back to OpenCV's CPU decoder.
+try:
+    import av
+    from av.codec.hwaccel import HWAccel
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# The VLM downsamples images internally, so larger frames only cost upload bandwidth
+MAX_FRAME_SIDE = 768
+JPEG_QUALITY = 85
+
+ENCODE_WORKERS = 4
+WRITE_WORKERS = 4
+
+def _open_cv2(video_path: str, target_fps: int) -> Tuple[float, float, Iterator[np.ndarray]]:
     """
-    Extracts frames from video and saves them as sorted image files in a folder.
-    
+    CPU decoding via OpenCV.
+    Returns: (original_fps, duration, sampled BGR frames)
+    Yielded frames share one reused buffer and are only valid until the next iteration.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Error: Could not open video file {video_path}")
+
+    original_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    duration = total_frames / original_fps if original_fps > 0 else 0
+
+    def frames():
+        # Decode sequentially and keep every `stride`-th frame instead of seeking.
+        # Seeking by timestamp restarts decoding from the nearest keyframe on every call.
+        stride = original_fps / target_fps if original_fps > 0 else 1.0
+        next_target_index = 0.0
+        frame_index = 0
+        # Decoded into the same buffer every time; consumers must copy a frame they want to keep
+        frame = None
+        try:
+            # grab() advances the decoder without converting the frame
+            while cap.grab():
+                if frame_index >= next_target_index:
+                    success, frame = cap.retrieve(frame)
+                    if not success:
+                        break
+                    yield frame
+                    next_target_index += stride
+                frame_index += 1
+        finally:
+            cap.release()
+
+    return original_fps, duration, frames()
+
+def _open_av(video_path: str, target_fps: int) -> Tuple[float, float, Iterator[np.ndarray]]:
+    """
+    GPU decoding via PyAV + NVDEC (falls back to FFmpeg's software decoder
+    if no CUDA device is available), sampled with FFmpeg's fps filter.
+    Returns: (original_fps, duration, sampled BGR frames)
+    """
+    try:
+        container = av.open(video_path, hwaccel=HWAccel(device_type="cuda", allow_software_fallback=True))
+    except av.FFmpegError:
+        # No usable CUDA device: retry with FFmpeg's software decoder
+        try:
+            container = av.open(video_path)
+        except av.FFmpegError as e:
+            raise ValueError(f"Error: Could not open video file {video_path}") from e
+
+    stream = container.streams.video[0]
+    stream.thread_type = "AUTO"
+    time_base = stream.time_base
+    original_fps = float(stream.average_rate) if stream.average_rate else 0.0
+    if stream.duration is not None:
+        duration = float(stream.duration * time_base)
+    elif container.duration is not None:
+        duration = container.duration / av.time_base
+    else:
+        duration = 0.0
+
+    def build_graph(first_frame) -> "av.filter.Graph":
+        # FFmpeg's fps filter does the frame selection in C, inside the decode loop.
+        # The buffer source is sized from the first decoded frame because hardware
+        # decoding may hand back a different pixel format than the stream reports.
+        graph = av.filter.Graph()
+        source = graph.add_buffer(
+            width=first_frame.width,
+            height=first_frame.height,
+            format=first_frame.format.name,
+            time_base=time_base,
+        )
+        fps_filter = graph.add("fps", f"fps={target_fps}")
+        sink = graph.add("buffersink")
+        source.link_to(fps_filter)
+        fps_filter.link_to(sink)
+        graph.configure()
+        return graph
+
+    def drain(graph):
+        while True:
+            try:
+                frame = graph.pull()
+            except (av.BlockingIOError, av.EOFError):
+                return
+            yield frame.to_ndarray(format="bgr24")
+
+    def frames():
+        graph = None
+        try:
+            for frame in container.decode(stream):
+                if graph is None:
+                    graph = build_graph(frame)
+                graph.push(frame)
+                yield from drain(graph)
+            if graph is not None:
+                # Flush frames still buffered in the filter
+                graph.push(None)
+                yield from drain(graph)
+        finally:
+            container.close()
+
+    return original_fps, duration, frames()
+
+def _open_video(video_path: str, target_fps: int, use_gpu: bool) -> Iterator[np.ndarray]:
+    if use_gpu and av is not None:
+        original_fps, duration, frames = _open_av(video_path, target_fps)
+    else:
+        original_fps, duration, frames = _open_cv2(video_path, target_fps)
+
+    logger.info("Processing video: %s (Original FPS: %.2f, Duration: %.2fs)", video_path, original_fps, duration)
+    return frames
+
+def extract_frames_to_memory(video_path: str, target_fps: int = 4, use_gpu: bool = True, max_side: Optional[int] = MAX_FRAME_SIDE) -> List[bytes]:
+    """
+    Extracts frames from video as in-memory JPEG bytes, without touching the disk.
+
     Args:
         video_path (str): Path to input video.
-        output_folder (str): Directory to save frames.
         target_fps (int): Frames per second to extract.
-        
+        use_gpu (bool): Decode with PyAV/NVDEC when PyAV is installed.
+        max_side (Optional[int]): Downscale frames so the longest side fits. None keeps native resolution.
+
+    Returns:
+        List[bytes]: JPEG-encoded frames, sorted by time.
+    """
+    frames = _open_video(video_path, target_fps, use_gpu)
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+    def _encode(index: int, frame: np.ndarray) -> bytes:
+        success, buf = cv2.imencode(".jpg", frame, encode_params)
+        if not success:
+            raise ValueError(f"Error: Could not encode frame {index} of {video_path}")
+        return buf.tobytes()
+
+    # JPEG encoding runs on worker threads (OpenCV releases the GIL) while the next frame decodes
+    futures = []
+    with ThreadPoolExecutor(max_workers=ENCODE_WORKERS) as executor:
+        for index, frame in enumerate(frames):
+            h, w = frame.shape[:2]
+            scale = max_side / max(h, w) if max_side else 1.0
+            if scale < 1:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            else:
+                # The decoder reuses its buffer, so hand the worker its own copy
+                frame = frame.copy()
+            futures.append(executor.submit(_encode, index, frame))
+
+        # .result() re-raises any encoding error
+        jpeg_frames = [future.result() for future in futures]
+
+    logger.info("Extracted %d frames from %s", len(jpeg_frames), video_path)
+    return jpeg_frames
+
+def save_frames(jpeg_frames: List[bytes], output_folder: str) -> List[str]:
+    """
+    Saves in-memory JPEG frames as sorted image files in a folder.
+
     Returns:
         List[str]: List of absolute paths to the saved image files, sorted by time.
     """
@@ -19,46 +191,35 @@ def extract_frames_to_folder(video_path: str, output_folder: str, target_fps: in
     if os.path.exists(output_folder):
         shutil.rmtree(output_folder)
     os.makedirs(output_folder)
-    
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise ValueError(f"Error: Could not open video file {video_path}")
-        
-    original_fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = total_frames / original_fps if original_fps > 0 else 0
-    
-    print(f"Processing video: {video_path}")
-    print(f"Original FPS: {original_fps:.2f}, Duration: {duration:.2f}s")
-    
-    frame_paths = []
-    step_seconds = 1.0 / target_fps
-    current_target_time = 0.0
-    frame_count = 0
-    
-    while True:
-        # Set position in milliseconds
-        cap.set(cv2.CAP_PROP_POS_MSEC, current_target_time * 1000)
-        success, frame = cap.read()
-        
-        if not success:
-            break
-            
+
+    def _write(frame_count: int, data: bytes) -> str:
         # Save frame to disk
         # Naming convention: frame_00001.jpg ensures natural sorting
         filename = f"frame_{frame_count:05d}.jpg"
         filepath = os.path.join(output_folder, filename)
-        cv2.imwrite(filepath, frame)
-        
-        frame_paths.append(os.path.abspath(filepath))
-        
-        current_target_time += step_seconds
-        frame_count += 1
-        
-        # Stop if we exceed duration (add buffer)
-        if current_target_time > duration + 0.1:
-            break
-            
-    cap.release()
-    print(f"Saved {len(frame_paths)} frames to {output_folder}")
+        with open(filepath, "wb") as f:
+            f.write(data)
+        return os.path.abspath(filepath)
+
+    # Writes are independent; overlap them instead of blocking on each one
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        frame_paths = list(executor.map(_write, range(len(jpeg_frames)), jpeg_frames))
+
+    logger.info("Saved %d frames to %s", len(frame_paths), output_folder)
     return frame_paths
+
+def extract_frames_to_folder(video_path: str, output_folder: str, target_fps: int = 4, use_gpu: bool = True, max_side: Optional[int] = MAX_FRAME_SIDE) -> List[str]:
+    """
+    Extracts frames from video and saves them as sorted image files in a folder.
+
+    Args:
+        video_path (str): Path to input video.
+        output_folder (str): Directory to save frames.
+        target_fps (int): Frames per second to extract.
+        use_gpu (bool): Decode with PyAV/NVDEC when PyAV is installed.
+        max_side (Optional[int]): Downscale frames so the longest side fits. None keeps native resolution.
+
+    Returns:
+        List[str]: List of absolute paths to the saved image files, sorted by time.
+    """
+    return save_frames(extract_frames_to_memory(video_path, target_fps, use_gpu, max_side), output_folder)
@@ -1,29 +1,286 @@
+import asyncio
+import functools
+import hashlib
+import io
+import logging
+import math
 import os
+import random
+import re
+import string
+import tempfile
+import threading
 import time
 import json
-from typing import List
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+import orjson
+from PIL import Image, ImageOps
+from pydantic import TypeAdapter, ValidationError
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from dotenv import load_dotenv
 from schemas import OlfactoryAnalysisReport, VisualAnalysisReport
+from video_processor import JPEG_QUALITY, MAX_FRAME_SIDE
 
-load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-os.environ.setdefault("GOOGLE_API_KEY", api_key or "")
-client = genai.Client()
+logger = logging.getLogger(__name__)
+
+@functools.cache
+def _client() -> genai.Client:
+    """
+    The shared Gemini client, created on first use.
+    Importing this module does not read .env or build a client.
+    """
+    load_dotenv()
+    os.environ.setdefault("GOOGLE_API_KEY", os.getenv("GOOGLE_API_KEY") or "")
+    return genai.Client()
 
 # Using 2.5-flash as it handles long context (many images) efficiently
 # Default fallback if not specified in config
 DEFAULT_MODEL = "gemini-2.5-flash"
 
-def load_config():
-    """Load configuration from config.json"""
+# Response schemas are static; generate them once instead of on every request
+_VISUAL_SCHEMA = VisualAnalysisReport.model_json_schema()
+_OLFACTORY_SCHEMA = OlfactoryAnalysisReport.model_json_schema()
+
+# Request configs are built (and validated by the SDK) once and shared by every call
+_VISUAL_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_json_schema=_VISUAL_SCHEMA
+)
+_OLFACTORY_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_json_schema=_OLFACTORY_SCHEMA
+)
+
+# Batched Step 2: one request maps several visual reports to an array of reports
+_OLFACTORY_BATCH_ADAPTER = TypeAdapter(List[OlfactoryAnalysisReport])
+_OLFACTORY_BATCH_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_json_schema=_OLFACTORY_BATCH_ADAPTER.json_schema()
+)
+
+# Step 1 reports keyed by (frames, prompt, config, fps); reused across conditions and reruns
+VISUAL_CACHE_DIR = os.path.join("cache", "visual")
+_visual_cache_locks = defaultdict(threading.Lock)
+_visual_cache_locks_guard = threading.Lock()
+
+# Step 2 reports keyed by (visual report, prompt, config, model); an identical Step 1 result skips the LLM
+OLFACTORY_CACHE_DIR = os.path.join("cache", "olfactory")
+
+# Explicit Gemini context caches for the static prompt prefixes
+PROMPT_CACHE_TTL_SECONDS = 3600
+_prompt_caches = {}
+_prompt_caches_lock = threading.Lock()
+_prompt_cache_create_locks = defaultdict(threading.Lock)
+
+# Step 1 requests per call (first attempt + retries on errors or incomplete coverage)
+STEP1_MAX_ATTEMPTS = 3
+# A Step 1 report is accepted when its frame_log reaches 95% of the video
+# with at least 80% of the expected entries (allowing minor fps drift)
+STEP1_MIN_COVERAGE = 0.95
+STEP1_MIN_ENTRY_RATIO = 0.8
+# A well-formed report that stops between 60% and 95% of the video is completed with a
+# continuation request for the remaining frames instead of re-analyzing the whole video
+STEP1_EXTEND_MIN_COVERAGE = 0.6
+
+# Step 1 responses are streamed. An attempt whose frame_log is still below STREAM_ABORT_COVERAGE
+# of the video twice the usual generation time after it started is cancelled and retried instead of awaited.
+STEP1_EXPECTED_GENERATION_SECONDS = 60
+STREAM_ABORT_COVERAGE = 0.5
+# Progress markers in the partial JSON. Only frame_log timestamps count, as in the coverage check:
+# visual_timeline comes first and one long interval can already reach the end of the video.
+_FRAME_LOG_KEY_RE = re.compile(r'"frame_log"\s*:')
+_PROGRESS_RE = re.compile(r'"timestamp"\s*:\s*(\d+(?:\.\d+)?)')
+
+# Explicit caches holding a Step 1 prompt prefix + its images, shared by the retries of one call.
+# Each is deleted when the last Step 1 call using it finishes, never while one is still in flight.
+FRAME_CACHE_TTL_SECONDS = 300
+# A cache this close to expiry gets its TTL extended before it is used for another attempt
+FRAME_CACHE_REFRESH_MARGIN_SECONDS = 60
+_frame_caches = {}
+_frame_cache_users = defaultdict(int)
+_frame_caches_lock = threading.Lock()
+# One lock per key, so concurrent callers wait for a single create without blocking other keys
+_frame_cache_create_locks = defaultdict(threading.Lock)
+
+# Per-request template fields. Everything before the first of them is a static
+# prefix that is identical across videos, retries and conditions sharing a config.
+STEP1_DYNAMIC_FIELDS = ("fps", "estimated_duration", "expected_entries")
+STEP2_DYNAMIC_FIELDS = ("visual_json",)
+
+# Gemini request and input-token budgets shared by every thread in this process
+REQUESTS_PER_MINUTE = 30
+TOKENS_PER_MINUTE = 1_000_000
+# Gemini bills each image at a fixed token count; text is estimated at ~4 characters per token
+IMAGE_TOKENS = 258
+# Pipelines in flight in analyze_dataset_async; each one issues two requests
+MAX_CONCURRENT_SEQUENCES = max(1, REQUESTS_PER_MINUTE // 2)
+# Retries of a single request after HTTP 429 (exponential backoff with jitter)
+MAX_RATE_LIMIT_RETRIES = 5
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: allows `max_rate` units (calls, tokens) per `time_period` seconds,
+    with bursts of up to `max_rate`.
+    """
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        # A single request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.max_rate)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_rate, self._tokens + (now - self._last) * self.max_rate / self.time_period)
+                self._last = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) * self.time_period / self.max_rate
+            time.sleep(wait)
+
+_limiter = RateLimiter(REQUESTS_PER_MINUTE, 60)
+_token_limiter = RateLimiter(TOKENS_PER_MINUTE, 60)
+
+def _estimate_tokens(contents) -> int:
+    """
+    Rough input-token count of a request's `contents`, for throttling only.
+    Parts held in a context cache are not counted.
+    """
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // 4
+    if isinstance(contents, list):
+        return sum(_estimate_tokens(c) for c in contents)
+    tokens = 0
+    for part in contents.parts or []:
+        if part.text:
+            tokens += len(part.text) // 4
+        elif part.inline_data or part.file_data:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+def _rate_limited(call, tokens: int = 0):
+    """
+    Runs `call` under the shared request and token budgets, so requests wait
+    for capacity up front instead of running into 429s.
+    Backs off exponentially (with jitter) when the API still answers 429.
+    """
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        _limiter.acquire()
+        if tokens:
+            _token_limiter.acquire(tokens)
+        try:
+            return call()
+        except errors.APIError as e:
+            if e.code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            delay = (2 ** attempt) + random.uniform(0, 1)
+            logger.warning("Rate limited (429). Backing off %.1fs...", delay)
+            time.sleep(delay)
+
+def _generate_content(**kwargs) -> types.GenerateContentResponse:
+    """
+    Rate-limited `_client().models.generate_content`.
+    """
+    return _rate_limited(lambda: _client().models.generate_content(**kwargs), _estimate_tokens(kwargs.get("contents")))
+
+def _generate_content_stream(**kwargs) -> Iterator[types.GenerateContentResponse]:
+    """
+    Rate-limited `_client().models.generate_content_stream`.
+    The request is only sent on the first `next()`, so that is where a 429 surfaces.
+    """
+    def _start():
+        stream = _client().models.generate_content_stream(**kwargs)
+        return stream, next(stream, None)
+
+    stream, first = _rate_limited(_start, _estimate_tokens(kwargs.get("contents")))
+    if first is not None:
+        yield first
+        yield from stream
+
+# Validators are compiled once at import and shared by every parse
+_VISUAL_ADAPTER = TypeAdapter(VisualAnalysisReport)
+_OLFACTORY_ADAPTER = TypeAdapter(OlfactoryAnalysisReport)
+
+CONFIG_PATH = "config.json"
+
+def _mtime(path: str) -> Optional[int]:
     try:
-        with open("config.json", "r") as f:
-            return json.load(f)
+        return os.stat(path).st_mtime_ns
     except FileNotFoundError:
-        print("Warning: config.json not found, using defaults.")
+        return None
+
+def _write_atomic(path: str, data: bytes):
+    """
+    Writes `data` under a unique temp name next to `path` and renames it into place, so
+    neither a concurrent reader nor an interrupted run ever leaves a partially written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# The caches below are keyed on file mtime, so edits to config.json or
+# the prompt files are picked up without restarting a long batch.
+
+@functools.lru_cache(maxsize=None)
+def _read_file(path: str, mtime: Optional[int]) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=None)
+def _load_config_cached(mtime: Optional[int]) -> dict:
+    if mtime is None:
+        logger.warning("Warning: config.json not found, using defaults.")
         return {}
+    return json.loads(_read_file(CONFIG_PATH, mtime))
+
+def load_config():
+    """
+    Load configuration from config.json.
+    Parsed once per file version; treat the returned dict as read-only.
+    """
+    return _load_config_cached(_mtime(CONFIG_PATH))
+
+def _model_name(section: str) -> str:
+    """
+    Model configured for a pipeline step ("step1_visual_config" / "step2_olfactory_config").
+    """
+    return load_config().get(section, {}).get("model_name", DEFAULT_MODEL)
+
+def _load_prompt_template(prompt_file: str) -> str:
+    """
+    Reads a prompt template once per file version.
+    Every condition, retry and video reuses the same string.
+    """
+    return _read_file(prompt_file, _mtime(prompt_file))
+
+@functools.lru_cache(maxsize=None)
+def _environmental_prompts_cached(mtime: Optional[int]) -> tuple[str, str]:
+    return _generate_environmental_prompt(_load_config_cached(mtime))
+
+def _environmental_prompts() -> tuple[str, str]:
+    """
+    Config-driven (step1_extra, step2_extra), rebuilt only when config.json changes.
+    """
+    return _environmental_prompts_cached(_mtime(CONFIG_PATH))
 
 def _generate_environmental_prompt(config: dict) -> tuple[str, str]:
     """
@@ -68,108 +325,583 @@ def _generate_environmental_prompt(config: dict) -> tuple[str, str]:
         
     return step1_extra, step2_extra
 
-def _step1_visual_analysis(frame_paths: List[str], fps: int, attempt: int = 1, prompt_file: str = "step1_visual.txt") -> VisualAnalysisReport:
+def _split_template(template: str, dynamic_fields: tuple) -> tuple[str, str]:
+    """
+    Splits a prompt template at its first per-request placeholder.
+    Returns: (static_prefix, dynamic_suffix), both still to be formatted.
+    """
+    pattern = r"(?<!\{)\{(?:" + "|".join(map(re.escape, dynamic_fields)) + r")[}:!]"
+    match = re.search(pattern, template)
+    if not match:
+        return template, ""
+    # Split at the start of that line so no sentence is cut in half
+    start = template.rfind("\n", 0, match.start()) + 1
+    return template[:start], template[start:]
+
+_FORMATTER = string.Formatter()
+
+@functools.lru_cache(maxsize=None)
+def _compile_template(prompt_file: str, mtime: Optional[int], dynamic_fields: tuple) -> tuple[tuple, tuple]:
+    """
+    Parses a prompt file once per file version into (static, dynamic) segment lists
+    of (literal, field, format_spec, conversion), as produced by string.Formatter.parse.
+    """
+    head, tail = _split_template(_read_file(prompt_file, mtime), dynamic_fields)
+    return tuple(_FORMATTER.parse(head)), tuple(_FORMATTER.parse(tail))
+
+def _fill_template(segments: tuple, values: dict) -> str:
+    """
+    Renders parsed segments. Placeholders without a value are kept verbatim instead of raising.
+    """
+    out = []
+    for literal, field, format_spec, conversion in segments:
+        out.append(literal)
+        if field is None:
+            continue
+        if field not in values:
+            out.append("{" + field + (f"!{conversion}" if conversion else "") + (f":{format_spec}" if format_spec else "") + "}")
+            continue
+        value = values[field]
+        if conversion:
+            value = _FORMATTER.convert_field(value, conversion)
+        out.append(format(value, format_spec))
+    return "".join(out)
+
+def _render_prompt(prompt_file: str, dynamic_fields: tuple, **values) -> tuple[str, str]:
+    """
+    Formats a prompt file as (static_prefix, dynamic_suffix).
+    Every condition gets the same values; templates simply ignore the ones they don't use.
+    """
+    head, tail = _compile_template(prompt_file, _mtime(prompt_file), dynamic_fields)
+    return _fill_template(head, values), _fill_template(tail, values)
+
+def _get_prompt_cache(model_name: str, static_prompt: str) -> Optional[str]:
+    """
+    Returns the name of an explicit context cache holding `static_prompt`, creating it on first use.
+    Returns None if the cache can't be used; the prefix is then sent inline and still benefits
+    from Gemini's implicit caching. A permanent refusal (e.g. the prefix is below the model's
+    minimum cache size) is remembered for the TTL; transient failures are retried on the next call.
+    """
+    key = (model_name, hashlib.sha256(static_prompt.encode()).hexdigest())
+
+    def _lookup():
+        cached = _prompt_caches.get(key)
+        # Leave a minute of margin so a request never references an expired cache
+        if cached and cached[1] > time.monotonic() + 60:
+            return cached
+        return None
+
+    with _prompt_caches_lock:
+        cached = _lookup()
+        if cached:
+            return cached[0]
+        create_lock = _prompt_cache_create_locks[key]
+
+    # Created outside _prompt_caches_lock so other prompts aren't held up by the request
+    with create_lock:
+        with _prompt_caches_lock:
+            cached = _lookup()
+            if cached:
+                return cached[0]
+
+        try:
+            cache = _client().caches.create(
+                model=model_name,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role="user", parts=[types.Part(text=static_prompt)])],
+                    ttl=f"{PROMPT_CACHE_TTL_SECONDS}s",
+                ),
+            )
+            name = cache.name
+        except errors.ClientError as e:
+            if e.code == 429:
+                logger.warning("Prompt cache creation rate limited for %s; sending the prompt inline.", model_name)
+                return None
+            logger.info("Prompt cache unavailable for %s (%s); sending the prompt inline.", model_name, e.code)
+            name = None
+        except Exception as e:
+            # Best effort: server and network errors only cost this request its cache
+            logger.warning("Prompt cache creation failed for %s (%s); sending the prompt inline.", model_name, e)
+            return None
+
+        with _prompt_caches_lock:
+            _prompt_caches[key] = (name, time.monotonic() + PROMPT_CACHE_TTL_SECONDS)
+        return name
+
+def _with_prompt_cache(model_name: str, static_prompt: str, base_config: types.GenerateContentConfig) -> tuple[list, types.GenerateContentConfig]:
+    """
+    Returns (leading parts, config) for a request: either a reference to the cached static prefix,
+    or the prefix itself as the first part.
+    """
+    cache_name = _get_prompt_cache(model_name, static_prompt)
+    if cache_name:
+        return [], base_config.model_copy(update={"cached_content": cache_name})
+    return [types.Part(text=static_prompt)], base_config
+
+def _delete_cache(name: str):
+    try:
+        _client().caches.delete(name=name)
+    except errors.APIError as e:
+        logger.warning("Could not delete context cache %s: %s", name, e)
+
+def _frame_cache_key(model_name: str, static_prompt: str, image_parts: List[types.Part]) -> str:
+    h = hashlib.sha256()
+    h.update(model_name.encode())
+    h.update(static_prompt.encode())
+    for part in image_parts:
+        h.update(part.file_data.file_uri.encode() if part.file_data else part.inline_data.data)
+    return h.hexdigest()
+
+def _get_frame_cache(key: str, model_name: str, static_prompt: str, image_parts: List[types.Part]) -> Optional[str]:
+    """
+    Returns the name of an explicit cache holding the static prompt and the images,
+    so Step 1 retries only send their per-video text.
+    Returns None if it can't be used. A returned cache must be handed back with `_release_frame_cache`.
+    """
+    with _frame_caches_lock:
+        cached = _frame_caches.get(key)
+        if cached and cached[1] > time.monotonic() + 30:
+            _frame_cache_users[key] += 1
+            return cached[0]
+        create_lock = _frame_cache_create_locks[key]
+
+    # The upload happens outside _frame_caches_lock, so other videos aren't held up by it
+    with create_lock:
+        with _frame_caches_lock:
+            cached = _frame_caches.get(key)
+            if cached and cached[1] > time.monotonic() + 30:
+                _frame_cache_users[key] += 1
+                return cached[0]
+
+        try:
+            cache = _client().caches.create(
+                model=model_name,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role="user", parts=[types.Part(text=static_prompt)] + image_parts)],
+                    ttl=f"{FRAME_CACHE_TTL_SECONDS}s",
+                ),
+            )
+        except errors.APIError as e:
+            logger.info("Frame cache unavailable for %s (%s); sending the frames inline.", model_name, e.code)
+            return None
+        except Exception as e:
+            # Best effort, like the prompt cache: a network error only costs the cache
+            logger.warning("Frame cache creation failed for %s (%s); sending the frames inline.", model_name, e)
+            return None
+
+        with _frame_caches_lock:
+            _frame_caches[key] = (cache.name, time.monotonic() + FRAME_CACHE_TTL_SECONDS)
+            _frame_cache_users[key] += 1
+    return cache.name
+
+def _live_frame_cache(key: str) -> Optional[str]:
+    """
+    Returns the frame cache's name for the next request, extending its TTL first when it is
+    about to expire (a slow attempt plus retries can outlive FRAME_CACHE_TTL_SECONDS).
+    Returns None if there is no cache or it can't be extended; the caller then sends the frames inline.
+    """
+    with _frame_caches_lock:
+        cached = _frame_caches.get(key)
+    if not cached:
+        return None
+
+    name, expires_at = cached
+    if expires_at > time.monotonic() + FRAME_CACHE_REFRESH_MARGIN_SECONDS:
+        return name
+
+    try:
+        _client().caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{FRAME_CACHE_TTL_SECONDS}s"))
+    except Exception as e:
+        logger.info("Could not extend frame cache %s (%s); sending the frames inline.", name, e)
+        with _frame_caches_lock:
+            _frame_caches.pop(key, None)
+        return None
+
+    with _frame_caches_lock:
+        if key in _frame_caches:
+            _frame_caches[key] = (name, time.monotonic() + FRAME_CACHE_TTL_SECONDS)
+    return name
+
+def _release_frame_cache(key: str):
+    """
+    Hands back a cache from `_get_frame_cache`. The last user deletes it,
+    instead of paying storage until the TTL.
+    """
+    with _frame_caches_lock:
+        _frame_cache_users[key] -= 1
+        if _frame_cache_users[key] > 0:
+            return
+        del _frame_cache_users[key]
+        cached = _frame_caches.pop(key, None)
+        _frame_cache_create_locks.pop(key, None)
+    if cached:
+        _delete_cache(cached[0])
+
+# A frame is either a path to a JPEG on disk or the in-memory JPEG bytes
+Frame = Union[str, bytes]
+
+# Re-encoded copies of oversized / EXIF-carrying frames on disk, keyed by path + mtime + encoding settings
+NORMALIZED_FRAME_DIR = ".frame_cache"
+
+def _normalize_frame(path: str) -> bytes:
+    """
+    JPEG bytes of a frame on disk, bounded to MAX_FRAME_SIDE and without metadata,
+    encoded like the frames from `extract_frames_to_memory`.
+    Frames that already fit are returned as-is; re-encoded ones are cached in .frame_cache/.
+    """
+    # The encoding settings are part of the key, so changing them never serves stale re-encodes
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{_mtime(path)}|{MAX_FRAME_SIDE}|{JPEG_QUALITY}".encode()).hexdigest()
+    cache_path = os.path.join(NORMALIZED_FRAME_DIR, f"{key}.jpg")
+    if os.path.exists(cache_path):
+        return Path(cache_path).read_bytes()
+
+    # Image.open only parses the header; pixels are decoded only if we re-encode
+    with Image.open(path) as img:
+        if img.format == "JPEG" and max(img.size) <= MAX_FRAME_SIDE and "exif" not in img.info:
+            return Path(path).read_bytes()
+
+        # Apply the EXIF orientation before the metadata is dropped
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((MAX_FRAME_SIDE, MAX_FRAME_SIDE), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+
+    data = buf.getvalue()
+    # Another condition on the same frame may be reading it concurrently
+    _write_atomic(cache_path, data)
+    return data
+
+def _read_frames(frame_paths: List[Frame]) -> List[bytes]:
+    """
+    Returns the JPEG bytes of every frame, in order.
+    Frames on disk are read (and normalized) concurrently so cold reads overlap instead of queueing.
+    """
+    paths = [p for p in frame_paths if not isinstance(p, bytes)]
+    if not paths:
+        return list(frame_paths)
+
+    with ThreadPoolExecutor(max_workers=min(32, len(paths))) as executor:
+        loaded = iter(list(executor.map(_normalize_frame, paths)))
+    return [p if isinstance(p, bytes) else next(loaded) for p in frame_paths]
+
+_JPEG_SOI = b"\xff\xd8"
+
+# Gemini rejects requests above 20MB. Inline blobs travel base64-encoded (4 bytes per 3),
+# and the prompt text and JSON framing need room too; larger frame sets go through the File API.
+INLINE_REQUEST_LIMIT_BYTES = 20 * 1024 * 1024
+INLINE_REQUEST_HEADROOM_BYTES = 1024 * 1024
+
+# Uploaded frames, keyed by path + mtime (or content hash for in-memory frames).
+# The File API keeps uploads for 48h, so handles are reused until shortly before they expire.
+_uploaded_files = {}
+_uploaded_files_lock = threading.Lock()
+# Per-frame locks, so concurrent Step 1 calls on the same video upload each frame once
+_upload_locks = defaultdict(threading.Lock)
+UPLOAD_EXPIRY_MARGIN = timedelta(hours=1)
+
+def _image_parts(frame_paths: List[Frame], file_handles: Optional[List[types.File]] = None) -> List[types.Part]:
+    """
+    Image parts for a Step 1 request: File API references if the frames were uploaded,
+    otherwise inline JPEG blobs. Inline frames are checked once here, so a bad frame
+    fails before any request is spent on it.
+    """
+    if file_handles:
+        # Frames were already uploaded; reference them by URI
+        return [types.Part(file_data=types.FileData(file_uri=h.uri, mime_type="image/jpeg")) for h in file_handles]
+
+    datas = _read_frames(frame_paths)
+    for i, data in enumerate(datas):
+        if not data.startswith(_JPEG_SOI):
+            raise ValueError(f"Frame {i} is not a JPEG image")
+
+    # Size of the frames as they go over the wire, base64-encoded
+    payload = sum(4 * math.ceil(len(d) / 3) for d in datas)
+    if payload > INLINE_REQUEST_LIMIT_BYTES - INLINE_REQUEST_HEADROOM_BYTES:
+        logger.info("Inline frames total %.1f MB encoded; referencing them through the File API instead.", payload / 2**20)
+        return _image_parts(frame_paths, upload_frames(datas))
+
+    return [types.Part(inline_data=types.Blob(data=d, mime_type="image/jpeg")) for d in datas]
+
+def _upload_key(frame: Frame) -> str:
+    if isinstance(frame, bytes):
+        return hashlib.sha1(frame).hexdigest()
+    return f"{os.path.abspath(frame)}|{_mtime(frame)}"
+
+def upload_frames(frame_paths: List[Frame]) -> List[types.File]:
+    """
+    Uploads frames once via the Gemini File API.
+    The returned handles can be reused across requests instead of re-inlining the JPEG bytes.
+    Frames uploaded earlier in this process are not uploaded again while their handle is valid.
+    """
+    def _upload(frame: Frame) -> types.File:
+        key = _upload_key(frame)
+        with _uploaded_files_lock:
+            upload_lock = _upload_locks[key]
+
+        with upload_lock:
+            with _uploaded_files_lock:
+                file = _uploaded_files.get(key)
+            if file and (file.expiration_time is None or file.expiration_time - UPLOAD_EXPIRY_MARGIN > datetime.now(timezone.utc)):
+                return file
+
+            data = frame if isinstance(frame, bytes) else _normalize_frame(frame)
+            file = _client().files.upload(file=io.BytesIO(data), config={"mime_type": "image/jpeg"})
+            with _uploaded_files_lock:
+                _uploaded_files[key] = file
+            return file
+
+    logger.info("Uploading %d frames to the File API...", len(frame_paths))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(_upload, frame_paths))
+
+def _stream_visual_response(model_name: str, contents: types.Content, gen_config: types.GenerateContentConfig, estimated_duration: float, allow_abort: bool) -> str:
+    """
+    Streams a Step 1 response and returns its full text.
+    Tracks how far into the video the partial frame_log already reaches, and with `allow_abort`
+    cancels a generation that is clearly heading for a failed coverage check.
+    """
+    stream = _generate_content_stream(model=model_name, contents=contents, config=gen_config)
+    chunks = []
+    scanned = ""
+    progress = 0.0
+    abort_below = STREAM_ABORT_COVERAGE * estimated_duration
+    abort_after = 2 * STEP1_EXPECTED_GENERATION_SECONDS
+    # Set once the frame_log key appears; the time budget runs from there
+    frame_log_start = None
+    try:
+        for chunk in stream:
+            text = chunk.text or ""
+            chunks.append(text)
+            # Keep a short tail so a key or number split across two chunks is still matched
+            scanned = scanned[-32:] + text
+            if frame_log_start is None:
+                key = _FRAME_LOG_KEY_RE.search(scanned)
+                if not key:
+                    continue
+                frame_log_start = time.monotonic()
+                scanned = scanned[key.end():]
+            for match in _PROGRESS_RE.finditer(scanned):
+                progress = max(progress, float(match.group(1)))
+
+            elapsed = time.monotonic() - frame_log_start
+            if allow_abort and elapsed > abort_after and progress < abort_below:
+                raise ValueError(f"Stream aborted after {elapsed:.0f}s at {progress:.2f}s / {estimated_duration:.2f}s coverage")
+    finally:
+        stream.close()
+
+    return "".join(chunks)
+
+def _extend_timeline(partial_report: VisualAnalysisReport, image_parts: List[types.Part], fps: int, start_ts: float, model_name: str, static_prompt: str, estimated_duration: float) -> VisualAnalysisReport:
+    """
+    Asks the VLM for the part of the video after `start_ts` only, sending just the remaining
+    frames and the existing frame_log, and appends the new entries to `partial_report`.
+    """
+    start_index = min(len(image_parts) - 1, int(start_ts * fps))
+    existing_log = orjson.dumps([e.model_dump(mode="json") for e in partial_report.frame_log]).decode()
+    continuation = (
+        "CONTINUATION REQUEST\n"
+        f"An earlier pass already analyzed 0.0s to {start_ts:.2f}s; its frame_log is given below.\n"
+        f"The frames that follow start at {start_index / fps:.2f}s and are sampled at {fps} FPS. "
+        f"The TOTAL video duration is exactly {estimated_duration:.2f} seconds.\n"
+        f"Analyze ONLY the remaining part, from {start_ts:.2f}s to {estimated_duration:.2f}s, "
+        f"and do NOT repeat entries at or before {start_ts:.2f}s.\n"
+        f"EXISTING frame_log:\n{existing_log}"
+    )
+
+    parts, gen_config = _with_prompt_cache(model_name, static_prompt, _VISUAL_GEN_CONFIG)
+    parts.append(types.Part(text=continuation))
+    parts += image_parts[start_index:]
+
+    logger.info("Extending Step 1 timeline from %.2fs with %d remaining frames...", start_ts, len(image_parts) - start_index)
+    response = _generate_content(
+        model=model_name,
+        contents=types.Content(role="user", parts=parts),
+        config=gen_config
+    )
+    if not response.text:
+        raise ValueError("Empty response from VLM Step 1 continuation")
+
+    tail = _VISUAL_ADAPTER.validate_json(response.text)
+    return partial_report.model_copy(update={
+        "frame_log": partial_report.frame_log + [e for e in tail.frame_log if e.timestamp > start_ts],
+        "visual_timeline": partial_report.visual_timeline + [i for i in tail.visual_timeline if i.time.end_s > start_ts],
+    })
+
+def _step1_visual_analysis(frame_paths: List[Frame], fps: int, prompt_file: str = "step1_visual.txt", file_handles: Optional[List[types.File]] = None) -> tuple[VisualAnalysisReport, bool]:
     """
     Step 1: Visual Understanding via VLM.
     Extracts scene semantics, objects, and activities.
+    Prompt and images are assembled once; only the request and its validation are retried.
+    Returns: (report, valid). `valid` is False when the last attempt still failed validation.
     """
-    config = load_config()
-    model_name = config.get("step1_visual_config", {}).get("model_name", DEFAULT_MODEL)
+    model_name = _model_name("step1_visual_config")
     
-    step1_extra, _ = _generate_environmental_prompt(config)
+    step1_extra, _ = _environmental_prompts()
     
     total_frames = len(frame_paths)
     estimated_duration = total_frames / fps
     expected_entries = int(estimated_duration)  # Expecting roughly 1 entry per second
+    # Acceptance thresholds, fixed for every attempt
+    min_entries = math.ceil(expected_entries * STEP1_MIN_ENTRY_RATIO)
+    min_last_timestamp = STEP1_MIN_COVERAGE * estimated_duration
     
-    print(f"[{model_name}] Starting Step 1: Visual Analysis on {total_frames} frames (Attempt {attempt}) using {prompt_file}...")
-    print(f"Estimated Video Duration: {estimated_duration:.2f}s. Expecting ~{expected_entries} log entries.")
-    
-    parts = []
+    logger.info("[%s] Starting Step 1: Visual Analysis on %d frames using %s...", model_name, total_frames, prompt_file)
+    logger.info("Estimated Video Duration: %.2fs. Expecting ~%d log entries.", estimated_duration, expected_entries)
     
     # 1. System Prompt for Step 1
-    # Load prompt from external file
+    # Static instructions first, per-video values after them, images last,
+    # so the long prefix is shared (and cached) across videos and retries
     try:
-        with open(prompt_file, "r") as f:
-            prompt_template = f.read()
-            # Handle prompt formatting (some might not use all variables)
+        static_prompt, dynamic_prompt = _render_prompt(
+            prompt_file,
+            STEP1_DYNAMIC_FIELDS,
+            fps=fps,
+            estimated_duration=estimated_duration,
+            expected_entries=expected_entries,
+            extra_requirements=step1_extra
+        )
+    except Exception as e:
+        logger.error("Error loading Step 1 prompt from %s: %s", prompt_file, e)
+        raise e
+
+    # 2. Add Images
+    # Built once and shared by the frame cache and every attempt
+    image_parts = _image_parts(frame_paths, file_handles)
+
+    # Prompt + images are cached once; every attempt then only sends the per-video text
+    frame_cache_key = _frame_cache_key(model_name, static_prompt, image_parts)
+    frame_cache_held = _get_frame_cache(frame_cache_key, model_name, static_prompt, image_parts) is not None
+
+    def _request() -> tuple[types.Content, types.GenerateContentConfig]:
+        # Re-checked per attempt: an expired frame cache falls back to inline frames
+        frame_cache = _live_frame_cache(frame_cache_key)
+        if frame_cache:
+            parts = [types.Part(text=dynamic_prompt)]
+            gen_config = _VISUAL_GEN_CONFIG.model_copy(update={"cached_content": frame_cache})
+        else:
+            parts, gen_config = _with_prompt_cache(model_name, static_prompt, _VISUAL_GEN_CONFIG)
+            parts.append(types.Part(text=dynamic_prompt))
+            parts += image_parts
+        return types.Content(role="user", parts=parts), gen_config
+
+    extend_from = STEP1_EXTEND_MIN_COVERAGE * estimated_duration
+
+    def _accepts(report: VisualAnalysisReport) -> bool:
+        if not report.frame_log:
+            logger.warning("WARNING: Step 1 returned empty frame_log.")
+            return False
+
+        # Strict Validation Criteria
+        # 1. Entry count must be at least 80% of expected (checked first: no timestamp needed)
+        entry_count = len(report.frame_log)
+        logger.info("Entry Count: %d / %d expected", entry_count, expected_entries)
+        if entry_count < min_entries:
+            logger.warning("WARNING: Output validation failed. Entries: %d < %d", entry_count, min_entries)
+            return False
+
+        # 2. Coverage must be at least 95% (Increased strictness)
+        last_timestamp = report.frame_log[-1].timestamp
+        logger.info("Step 1 Output Coverage: %.2fs / %.2fs (%.1f%%)", last_timestamp, estimated_duration, 100 * last_timestamp / estimated_duration)
+        if last_timestamp < min_last_timestamp:
+            logger.warning("WARNING: Output validation failed. Coverage: %.2f, Entries: %d", last_timestamp / estimated_duration, entry_count)
+            return False
+        return True
+
+    try:
+        for attempt in range(1, STEP1_MAX_ATTEMPTS + 1):
+            logger.info("Sending visual data to VLM (Attempt %d)...", attempt)
+            contents, gen_config = _request()
             try:
-                prompt = prompt_template.format(
-                    fps=fps,
-                    estimated_duration=estimated_duration,
-                    expected_entries=expected_entries,
-                    extra_requirements=step1_extra
-                )
-            except KeyError:
-                 # Fallback for baselines that might not need all vars
-                 prompt = prompt_template.format(
-                    fps=fps,
-                    estimated_duration=estimated_duration
+                # The last attempt is never cut short; its output is used either way
+                response_text = _stream_visual_response(
+                    model_name,
+                    contents,
+                    gen_config,
+                    estimated_duration,
+                    allow_abort=attempt < STEP1_MAX_ATTEMPTS
                 )
+
+                if not response_text:
+                    raise ValueError("Empty response from VLM Step 1")
+
+                report = _VISUAL_ADAPTER.validate_json(response_text)
+
+            except Exception as e:
+                logger.error("Step 1 Failed: %s", e)
+                if attempt < STEP1_MAX_ATTEMPTS:
+                    logger.warning("Retry triggered on error! Starting attempt %d...", attempt + 1)
+                    continue
+                raise e
+
+            # --- Validation Logic ---
+            valid_coverage = _accepts(report)
+
+            # Well-formed but stopped short: complete the tail instead of starting over
+            if not valid_coverage and report.frame_log and extend_from <= report.frame_log[-1].timestamp < min_last_timestamp:
+                try:
+                    report = _extend_timeline(report, image_parts, fps, report.frame_log[-1].timestamp, model_name, static_prompt, estimated_duration)
+                    valid_coverage = _accepts(report)
+                except Exception as e:
+                    logger.error("Step 1 timeline extension failed: %s", e)
+
+            if valid_coverage:
+                return report, True
+            if attempt < STEP1_MAX_ATTEMPTS:
+                logger.warning("Retry triggered! Starting attempt %d...", attempt + 1)
+            else:
+                logger.critical("CRITICAL: Max retries reached. Proceeding with incomplete data.")
+                return report, False
+
+    finally:
+        if frame_cache_held:
+            _release_frame_cache(frame_cache_key)
+
+def _step2_prompt(prompt_file: str, visual_json: str) -> tuple[str, str]:
+    """
+    Renders a Step 2 prompt as (static_prefix, dynamic_suffix).
+    """
+    _, step2_extra = _environmental_prompts()
+
+    # The visual report is the only per-request part; it comes last so the instructions stay a cacheable prefix
+    try:
+        return _render_prompt(
+            prompt_file,
+            STEP2_DYNAMIC_FIELDS,
+            visual_json=visual_json,
+            extra_rules=step2_extra
+        )
     except Exception as e:
-        print(f"Error loading Step 1 prompt from {prompt_file}: {e}")
+        logger.error("Error loading Step 2 prompt from %s: %s", prompt_file, e)
         raise e
-        
-    parts.append(types.Part(text=prompt))
-    
-    # 2. Add Images
-    for p in frame_paths:
-        with open(p, "rb") as f:
-            img_data = f.read()
-        parts.append(types.Part(inline_data=types.Blob(data=img_data, mime_type="image/jpeg")))
-        
-    print("Sending visual data to VLM...")
-    
+
+def _step2_request(model_name: str, prompt_file: str, visual_json: str, base_config: types.GenerateContentConfig, parse, trailer: str = ""):
+    """
+    Sends one Step 2 request and returns `parse(response_text)`.
+    Shared by the per-video and the batched Step 2.
+    """
+    static_prompt, dynamic_prompt = _step2_prompt(prompt_file, visual_json)
+
+    parts, gen_config = _with_prompt_cache(model_name, static_prompt, base_config)
+    parts.append(types.Part(text=dynamic_prompt))
+    if trailer:
+        parts.append(types.Part(text=trailer))
+
     try:
-        response = client.models.generate_content(
+        response = _generate_content(
             model=model_name,
-            contents=types.Content(parts=parts),
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": VisualAnalysisReport.model_json_schema()
-            }
+            contents=types.Content(role="user", parts=parts),
+            config=gen_config
         )
-        
+
         if not response.text:
-            raise ValueError("Empty response from VLM Step 1")
-            
-        report = VisualAnalysisReport.model_validate_json(response.text)
-        
-        # --- Validation Logic ---
-        if not report.frame_log:
-             print("WARNING: Step 1 returned empty frame_log.")
-             valid_coverage = False
-        else:
-            last_timestamp = report.frame_log[-1].timestamp
-            entry_count = len(report.frame_log)
-            coverage_ratio = last_timestamp / estimated_duration
-            
-            print(f"Step 1 Output Coverage: {last_timestamp:.2f}s / {estimated_duration:.2f}s ({coverage_ratio:.1%})")
-            print(f"Entry Count: {entry_count} / {expected_entries} expected")
-            
-            # Strict Validation Criteria
-            # 1. Coverage must be at least 95% (Increased strictness)
-            # 2. Entry count must be at least 80% of expected (allowing minor fps drift)
-            if coverage_ratio >= 0.95 and entry_count >= (expected_entries * 0.8):
-                valid_coverage = True
-            else:
-                valid_coverage = False
-                print(f"WARNING: Output validation failed. Coverage: {coverage_ratio:.2f}, Entries: {entry_count}")
+            raise ValueError("Empty response from LLM Step 2")
+
+        return parse(response.text)
 
-        if not valid_coverage:
-            if attempt < 3:
-                print(f"Retry triggered! Starting attempt {attempt + 1}...")
-                return _step1_visual_analysis(frame_paths, fps, attempt + 1, prompt_file)
-            else:
-                print("CRITICAL: Max retries reached. Proceeding with incomplete data.")
-                
-        return report
-        
     except Exception as e:
-        print(f"Step 1 Failed: {e}")
-        if attempt < 3:
-             print(f"Retry triggered on error! Starting attempt {attempt + 1}...")
-             return _step1_visual_analysis(frame_paths, fps, attempt + 1, prompt_file)
+        logger.error("Step 2 Failed: %s", e)
         raise e
 
 def _step2_olfactory_inference(visual_report: VisualAnalysisReport, prompt_file: str = "step2_olfactory.txt") -> OlfactoryAnalysisReport:
@@ -177,83 +909,235 @@ def _step2_olfactory_inference(visual_report: VisualAnalysisReport, prompt_file:
     Step 2: Semantic-to-Chemical Translation via LLM.
     Maps visual semantics to olfactory representations.
     """
-    config = load_config()
-    model_name = config.get("step2_olfactory_config", {}).get("model_name", DEFAULT_MODEL)
+    model_name = _model_name("step2_olfactory_config")
     
-    _, step2_extra = _generate_environmental_prompt(config)
-    
-    print(f"[{model_name}] Starting Step 2: Olfactory Inference (LLM) using {prompt_file}...")
+    logger.info("[%s] Starting Step 2: Olfactory Inference (LLM) using %s...", model_name, prompt_file)
     
     # Convert visual report to JSON string for the prompt
-    visual_json = visual_report.model_dump_json(indent=2)
+    # (compact: the model does not need indentation, and it saves prompt tokens)
+    visual_json = orjson.dumps(visual_report.model_dump(mode="json")).decode()
     
-    # Load prompt from external file
+    return _step2_request(
+        model_name,
+        prompt_file,
+        visual_json,
+        _OLFACTORY_GEN_CONFIG,
+        _OLFACTORY_ADAPTER.validate_json
+    )
+
+def _parse_report_batch(text: str, expected: int) -> List[OlfactoryAnalysisReport]:
+    reports = _OLFACTORY_BATCH_ADAPTER.validate_json(text)
+
+    if len(reports) != expected:
+        raise ValueError(f"Expected {expected} reports from batched Step 2, got {len(reports)}")
+    return reports
+
+def _step2_olfactory_inference_batch(visual_reports: List[VisualAnalysisReport], prompt_file: str = "step2_olfactory.txt") -> List[OlfactoryAnalysisReport]:
+    """
+    Step 2 for several videos in a single request.
+    Uses the same static prefix (and prompt cache) as the per-video call;
+    only the input data becomes a JSON array of visual reports.
+    """
+    model_name = _model_name("step2_olfactory_config")
+    count = len(visual_reports)
+
+    logger.info("[%s] Starting Step 2: Olfactory Inference (LLM) on %d reports using %s...", model_name, count, prompt_file)
+
+    visual_json = orjson.dumps([r.model_dump(mode="json") for r in visual_reports]).decode()
+
+    return _step2_request(
+        model_name,
+        prompt_file,
+        visual_json,
+        _OLFACTORY_BATCH_GEN_CONFIG,
+        lambda text: _parse_report_batch(text, count),
+        trailer=(
+            f"INPUT DATA is a JSON array of {count} independent Step 1 reports, one per video. "
+            f"Analyze each one separately and return a JSON array of exactly {count} reports, in the same order."
+        )
+    )
+
+def _visual_cache_key(frame_paths: List[Frame], fps: int, prompt_file: str) -> str:
+    """
+    Hash of every input that determines a Step 1 report.
+    Frames are hashed by content, so re-extracted frames of the same video still hit.
+    """
+    config = load_config()
+    h = hashlib.sha256()
+    h.update(_load_prompt_template(prompt_file).encode())
+    h.update(json.dumps(config.get("step1_visual_config", {}), sort_keys=True).encode())
+    h.update(str(fps).encode())
+    for data in _read_frames(frame_paths):
+        h.update(data)
+    return h.hexdigest()
+
+def _load_cached_report(adapter: TypeAdapter, cache_path: str):
+    """
+    Returns the report cached at `cache_path`, or None if there is none or it can't be read.
+    A corrupt entry (e.g. from a run killed by an older, non-atomic writer) is treated as a miss
+    and overwritten by the fresh result instead of failing every later run.
+    """
     try:
-        with open(prompt_file, "r") as f:
-            prompt_template = f.read()
-            # Handle different prompt formatting needs
-            # The standard prompt expects {visual_json} and {extra_rules}
-            # Baseline prompts might only expect {visual_json}
-            # We use safe substitution or try/except to handle this
-            
-            # Simple approach: Check format keys
-            try:
-                prompt = prompt_template.format(
-                    visual_json=visual_json,
-                    extra_rules=step2_extra
-                )
-            except KeyError:
-                 # Fallback for baselines that might not have {extra_rules}
-                 prompt = prompt_template.format(
-                    visual_json=visual_json
-                )
+        with open(cache_path, "rb") as f:
+            return adapter.validate_json(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValidationError) as e:
+        logger.warning("Ignoring unreadable cache entry %s: %s", cache_path, e)
+        return None
+
+def perform_visual_analysis(frame_paths: List[Frame], fps: int, prompt_file: str = "step1_visual.txt", file_handles: Optional[List[types.File]] = None, use_cache: bool = True, upload: bool = False) -> VisualAnalysisReport:
+    """
+    Public wrapper for Step 1, cached on disk under cache/visual/.
+    Pass `file_handles` from `upload_frames` to reuse already uploaded frames, or `upload=True`
+    to upload them on a cache miss; calls on the same frames share one upload.
+    With `use_cache=False` the cached report is ignored and overwritten by a fresh one.
+    """
+    # Frames on disk are read and normalized once, for both the cache key and the request
+    frames = _read_frames(frame_paths)
+    key = _visual_cache_key(frames, fps, prompt_file)
+    cache_path = os.path.join(VISUAL_CACHE_DIR, f"{key}.json")
+
+    with _visual_cache_locks_guard:
+        lock = _visual_cache_locks[key]
+
+    # Concurrent conditions with an identical visual setup wait for the first one instead of re-running Step 1
+    with lock:
+        cached = _load_cached_report(_VISUAL_ADAPTER, cache_path) if use_cache else None
+        if cached is not None:
+            logger.info("Step 1 cache hit for %s: %s", prompt_file, cache_path)
+            return cached
+
+        # Uploaded only now that Step 1 actually runs; a cache hit needs no frames at all
+        if upload and not file_handles:
+            file_handles = upload_frames(frames)
 
+        report, valid = _step1_visual_analysis(frames, fps, prompt_file=prompt_file, file_handles=file_handles)
+
+        # An incomplete timeline is used for this run but not cached, so the next run retries it
+        if not valid:
+            return report
+
+        _write_atomic(cache_path, report.model_dump_json().encode())
+        return report
+
+def _olfactory_cache_key(visual_report: VisualAnalysisReport, prompt_file: str) -> str:
+    """
+    Hash of every input that determines a Step 2 report.
+    """
+    step2_config = load_config().get("step2_olfactory_config", {})
+    h = hashlib.blake2b(digest_size=32)
+    h.update(_model_name("step2_olfactory_config").encode())
+    h.update(_load_prompt_template(prompt_file).encode())
+    h.update(json.dumps(step2_config, sort_keys=True).encode())
+    h.update(orjson.dumps(visual_report.model_dump(mode="json")))
+    return h.hexdigest()
+
+def perform_olfactory_inference(visual_report: VisualAnalysisReport, prompt_file: str = "step2_olfactory.txt", use_cache: bool = True) -> OlfactoryAnalysisReport:
+    """
+    Public wrapper for Step 2, cached on disk under cache/olfactory/.
+    With `use_cache=False` the cached report is ignored and overwritten by a fresh one.
+    """
+    key = _olfactory_cache_key(visual_report, prompt_file)
+    cache_path = os.path.join(OLFACTORY_CACHE_DIR, f"{key}.json")
+
+    cached = _load_cached_report(_OLFACTORY_ADAPTER, cache_path) if use_cache else None
+    if cached is not None:
+        logger.info("Step 2 cache hit for %s: %s", prompt_file, cache_path)
+        return cached
+
+    report = _step2_olfactory_inference(visual_report, prompt_file)
+
+    _write_atomic(cache_path, report.model_dump_json().encode())
+    return report
+
+def perform_olfactory_inference_batch(visual_reports: List[VisualAnalysisReport], prompt_file: str = "step2_olfactory.txt", use_cache: bool = True) -> List[OlfactoryAnalysisReport]:
+    """
+    Public wrapper for batched Step 2, sharing the cache/olfactory/ entries of `perform_olfactory_inference`.
+    Only reports without a cached result are sent (all of them with `use_cache=False`), together in one request.
+    Falls back to one request per report if the batched answer is unusable.
+    """
+    cache_paths = [os.path.join(OLFACTORY_CACHE_DIR, f"{_olfactory_cache_key(r, prompt_file)}.json") for r in visual_reports]
+    results = [_load_cached_report(_OLFACTORY_ADAPTER, p) if use_cache else None for p in cache_paths]
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    logger.info("Step 2 batch: %d cached, %d to infer", len(visual_reports) - len(missing), len(missing))
+    if not missing:
+        return results
+
+    try:
+        reports = _step2_olfactory_inference_batch([visual_reports[i] for i in missing], prompt_file)
     except Exception as e:
-        print(f"Error loading Step 2 prompt from {prompt_file}: {e}")
-        raise e
-    
+        logger.warning("Batched Step 2 failed (%s); falling back to one request per report.", e)
+        reports = [_step2_olfactory_inference(visual_reports[i], prompt_file) for i in missing]
+
+    for i, report in zip(missing, reports):
+        _write_atomic(cache_paths[i], report.model_dump_json().encode())
+        results[i] = report
+    return results
+
+def _prefetch_step2_prompt_cache(prompt_file: str = "step2_olfactory.txt"):
+    """
+    Creates the Step 2 prompt-prefix cache ahead of time.
+    The prefix does not depend on the visual report, so this can run while Step 1 is in flight.
+    Only an optimization: a failure is logged and Step 2 creates (or skips) the cache itself.
+    """
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": OlfactoryAnalysisReport.model_json_schema()
-            }
-        )
-        
-        if not response.text:
-            raise ValueError("Empty response from LLM Step 2")
-            
-        return OlfactoryAnalysisReport.model_validate_json(response.text)
-        
+        static_prompt, _ = _step2_prompt(prompt_file, visual_json="")
+        _get_prompt_cache(_model_name("step2_olfactory_config"), static_prompt)
     except Exception as e:
-        print(f"Step 2 Failed: {e}")
-        raise e
+        logger.warning("Step 2 prompt cache prefetch failed: %s", e)
 
-def perform_visual_analysis(frame_paths: List[str], fps: int, prompt_file: str = "step1_visual.txt") -> VisualAnalysisReport:
+async def analyze_video_sequence_async(frame_paths: List[Frame], fps: int, executor: Optional[ThreadPoolExecutor] = None) -> OlfactoryAnalysisReport:
     """
-    Public wrapper for Step 1.
+    Orchestrates the 2-step VOS pipeline (Standard "Ours" Mode).
+    The Step 2 prompt cache is created while Step 1 runs, so Step 2 starts without that round-trip.
+    The blocking steps run on `executor`, or on the loop's default executor if none is given.
     """
-    return _step1_visual_analysis(frame_paths, fps, prompt_file=prompt_file)
+    loop = asyncio.get_running_loop()
 
-def perform_olfactory_inference(visual_report: VisualAnalysisReport, prompt_file: str = "step2_olfactory.txt") -> OlfactoryAnalysisReport:
+    # Step 1: Visual Analysis (+ Step 2 cache prefetch)
+    (visual_report, _), _ = await asyncio.gather(
+        loop.run_in_executor(executor, _step1_visual_analysis, frame_paths, fps),
+        loop.run_in_executor(executor, _prefetch_step2_prompt_cache)
+    )
+    logger.info("Step 1 Complete. Visual Timeline extracted.")
+    
+    # Step 2: Olfactory Inference (Default)
+    final_report = await loop.run_in_executor(executor, _step2_olfactory_inference, visual_report)
+    logger.info("Step 2 Complete. Chemical mapping finished.")
+    
+    return final_report
+
+async def analyze_dataset_async(sequences: List[tuple[List[Frame], int]], max_concurrent: int = MAX_CONCURRENT_SEQUENCES) -> list:
     """
-    Public wrapper for Step 2.
+    Runs the 2-step pipeline on many videos concurrently.
+    `sequences` holds (frames, fps) per video. At most `max_concurrent` pipelines are in flight;
+    their requests are additionally throttled by the shared request/token buckets.
+    Returns one report per video, in order, or the exception that video raised.
     """
-    return _step2_olfactory_inference(visual_report, prompt_file)
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    # Sized for Step 1 plus the Step 2 prefetch of every pipeline in flight; the loop's default
+    # executor (min(32, cpu + 4) threads) would cap concurrency below max_concurrent on small machines
+    with ThreadPoolExecutor(max_workers=2 * max_concurrent) as executor:
+        async def _run(frame_paths: List[Frame], fps: int) -> OlfactoryAnalysisReport:
+            async with semaphore:
+                return await analyze_video_sequence_async(frame_paths, fps, executor)
 
-def analyze_video_sequence(frame_paths: List[str], fps: int) -> OlfactoryAnalysisReport:
+        return await asyncio.gather(*(_run(frame_paths, fps) for frame_paths, fps in sequences), return_exceptions=True)
+
+def analyze_video_sequence(frame_paths: List[Frame], fps: int) -> OlfactoryAnalysisReport:
     """
-    Orchestrates the 2-step VOS pipeline (Standard "Ours" Mode).
-    Kept for backward compatibility.
+    Orchestrates the 2-step VOS pipeline (Standard "Ours" Mode) in the calling thread.
+    Kept for backward compatibility; unlike `asyncio.run`, this also works inside a running event loop.
     """
     # Step 1: Visual Analysis
-    visual_report = _step1_visual_analysis(frame_paths, fps)
-    print("Step 1 Complete. Visual Timeline extracted.")
+    visual_report, _ = _step1_visual_analysis(frame_paths, fps)
+    logger.info("Step 1 Complete. Visual Timeline extracted.")
     
     # Step 2: Olfactory Inference (Default)
     final_report = _step2_olfactory_inference(visual_report)
-    print("Step 2 Complete. Chemical mapping finished.")
+    logger.info("Step 2 Complete. Chemical mapping finished.")
     
     return final_report